@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+----------------------------------------------------------------------
+Benchmark of the melody extraction: speed and raw pitch accuracy of the
+pitch tracking backends on synthetic guitar-like solos.
+----------------------------------------------------------------------
+The solos are plucked notes with decaying harmonics on known F0
+trajectories: steady notes, bends, slides and vibrato, separated by
+short rests. Every configuration runs extract_melody in a fresh Python
+process which synthesizes the solo itself, so that its time and peak
+memory do not depend on the configurations measured before.
+
+A configuration is a backend optionally followed by extract_melody
+arguments, e.g. melodia, yin, yin:coarse=4 or melodia:block=30.
+
+Optional args:
+    Please refer to --help.
+----------------------------------------------------------------------
+Returns:
+    JSON list of results, one per signal and configuration:
+        config, signal, duration (s), time (s), frames_per_second,
+        real_time (seconds of audio per second), peak_memory (MB above
+        the memory of the inputs), raw_pitch_accuracy (voiced frames
+        within 50 cents), voicing_false_alarm (unvoiced frames with a
+        positive pitch)
+
+"""
+import sys
+import numpy as np
+from benchmark_utils import time_isolated, write_report, BenchmarkError
+from guitar_trans.parameters import SAMPLING_RATE, HOP_LENGTH
+from melody_extraction import extract_melody
+
+SIGNALS = ['steady', 'bend', 'slide', 'vibrato', 'mixed']
+CONFIGS = ['melodia', 'yin']
+
+def f0_trajectory(duration, fs, kind, bend=2., vibrato_rate=5.5, vibrato_depth=0.5, seed=0):
+    """
+    F0 trajectory of a solo of random notes of a guitar's range.
+
+    :param duration:      length in seconds.
+    :param fs:            sampling frequency in Hz.
+    :param kind:          'steady', 'bend', 'slide', 'vibrato' or 'mixed' notes.
+    :param bend:          bend (and slide) interval in semitones.
+    :param vibrato_rate:  vibrato rate in Hz.
+    :param vibrato_depth: vibrato depth in semitones (peak).
+    :param seed:          seed of the random generator.
+    :returns:             F0 in Hz [t samples] (0 in rests) and onsets in samples.
+
+    """
+    rng = np.random.RandomState(seed)
+    n = int(duration*fs)
+    midi = np.zeros(n)
+    onsets = []
+    s = 0
+    while s < n:
+        e = min(n, s + int(rng.uniform(0.4, 1.2)*fs))
+        k = kind if kind != 'mixed' else SIGNALS[rng.randint(0, 4)]
+        t = np.arange(e - s)/float(fs)
+        pitch = rng.randint(45, 82)
+        if k == 'steady':
+            midi[s:e] = pitch
+        elif k == 'bend':
+            ### bend up in 150 ms after a third of the note
+            midi[s:e] = pitch + bend*np.clip((t - t[-1]/3.)/0.15, 0, 1)
+        elif k == 'slide':
+            ### slide in 80 ms from the middle of the note
+            midi[s:e] = pitch + np.round(bend)*np.clip((t - t[-1]/2.)/0.08, 0, 1)
+        elif k == 'vibrato':
+            midi[s:e] = pitch + vibrato_depth*np.sin(2*np.pi*vibrato_rate*t)
+        onsets.append(s)
+        ### rest before the next note
+        s = e + int(rng.uniform(0., 0.3)*fs)
+    f0 = np.where(midi > 0, 440*2**((midi-69)/12.), 0)
+    return f0, onsets
+
+def synthesize_solo(f0, onsets, fs, seed=0):
+    """
+    Synthesize plucked notes on a F0 trajectory.
+
+    :param f0:     F0 in Hz [t samples] (0 in rests).
+    :param onsets: onsets of the notes in samples.
+    :param fs:     sampling frequency in Hz.
+    :param seed:   seed of the random generator.
+    :returns:      mono float32 signal [t samples].
+
+    """
+    rng = np.random.RandomState(seed)
+    phase = 2*np.pi*np.cumsum(f0)/fs
+    ### time since the last onset, for the pluck envelope
+    last = np.zeros(len(f0), dtype=int)
+    last[onsets] = onsets
+    since = np.arange(len(f0)) - np.maximum.accumulate(last)
+    x = np.zeros(len(f0))
+    for h in range(1, 9):
+        ### upper harmonics decay faster, none above the Nyquist frequency
+        env = np.exp(-since/float(fs)*(1.5 + 0.8*h)) * (f0*h < fs/2.)
+        x += env*np.sin(h*phase + rng.uniform(0, 2*np.pi))/h
+    x *= f0 > 0
+    x += 1e-3*rng.randn(len(x))
+    return (0.5*x/np.max(np.abs(x))).astype('float32')
+
+def raw_pitch_accuracy(ref, est, cents=50):
+    """
+    :param ref:   reference F0 in Hz per frame (0 if unvoiced).
+    :param est:   estimated F0 in Hz per frame (unvoiced if not positive).
+    :returns:     fraction of voiced reference frames with an estimate
+                  within the tolerance in cents, regardless of its voicing,
+                  and fraction of unvoiced reference frames estimated voiced.
+
+    """
+    voiced = ref > 0
+    est_abs = np.abs(est[voiced])
+    ok = est_abs > 0
+    err = np.full(est_abs.shape, np.inf)
+    err[ok] = 1200*np.abs(np.log2(est_abs[ok]/ref[voiced][ok]))
+    rpa = np.mean(err <= cents) if voiced.any() else float('nan')
+    vfa = np.mean(est[~voiced] > 0) if (~voiced).any() else float('nan')
+    return rpa, vfa
+
+def parse_config(config):
+    """
+    :param config: backend[:name=value[,name=value...]].
+    :returns:      keyword arguments of extract_melody.
+
+    """
+    backend, _, opts = config.partition(':')
+    kwargs = {'backend': backend}
+    for opt in filter(None, opts.split(',')):
+        name, value = opt.split('=')
+        kwargs[name] = float(value) if name == 'block' else int(value)
+    return kwargs
+
+def solo(duration, signal, seed=0, **synth):
+    """
+    :returns:  F0 trajectory in Hz per sample and mono float32 signal at SAMPLING_RATE.
+
+    """
+    f0, onsets = f0_trajectory(duration, SAMPLING_RATE, signal, seed=seed, **synth)
+    return f0, synthesize_solo(f0, onsets, SAMPLING_RATE, seed=seed)
+
+def config_function(duration, signal, seed, synth, kwargs):
+    """
+    Synthesize a solo and bind extract_melody to it (run by the worker process).
+
+    :param kwargs:  keyword arguments of extract_melody.
+    :returns:       function without arguments returning the melody contour in Hz.
+
+    """
+    _, x = solo(duration, signal, seed, **synth)
+    return lambda: extract_melody(None, audio=x, **kwargs)[0]
+
+def benchmark(duration, signals=SIGNALS, configs=CONFIGS, repeat=3, **synth):
+    """
+    Benchmark configurations of the melody extraction on synthetic solos.
+
+    :param duration:  length of the solos in seconds.
+    :param signals:   kinds of solos.
+    :param configs:   configurations (see parse_config).
+    :param repeat:    number of runs per configuration.
+    :param synth:     bend, vibrato_rate and vibrato_depth of f0_trajectory.
+    :returns:         list of result dicts (with an error message for failed configurations).
+
+    """
+    results = []
+    for i, signal in enumerate(signals):
+        f0, x = solo(duration, signal, i, **synth)
+        ### reference at the frame centres
+        n = 1 + len(x) // HOP_LENGTH
+        ref = f0[np.minimum(np.arange(n)*HOP_LENGTH, len(f0)-1)]
+        for config in configs:
+            try:
+                elapsed, peak, mc = time_isolated('benchmark_melody', 'config_function',
+                    {'duration': duration, 'signal': signal, 'seed': i, 'synth': synth,
+                     'kwargs': parse_config(config)}, repeat)
+            except (BenchmarkError, ValueError) as e:
+                ### e.g. melodia without essentia, or a misspelt configuration
+                print >> sys.stderr, '  {:>18s} {:>8s}: failed, {}'.format(config, signal, e)
+                results.append({'config': config, 'signal': signal, 'duration': duration,
+                                'error': str(e)})
+                continue
+            rpa, vfa = raw_pitch_accuracy(ref, mc[:n])
+            res = {'config': config, 'signal': signal, 'duration': duration,
+                   'time': elapsed, 'frames_per_second': len(mc)/elapsed,
+                   'real_time': duration/elapsed, 'peak_memory': peak,
+                   'raw_pitch_accuracy': rpa, 'voicing_false_alarm': vfa}
+            print >> sys.stderr, '  {config:>18s} {signal:>8s}: {time:7.3f}s, ' \
+                '{frames_per_second:9.0f} frames/s, {peak_memory:7.1f} MB, ' \
+                'RPA {raw_pitch_accuracy:.3f}, VFA {voicing_false_alarm:.3f}'.format(**res)
+            results.append(res)
+    return results
+
+def parser():
+    import argparse
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=
+    """
+===================================================================
+Script for benchmarking the melody extraction.
+===================================================================
+    """)
+    p.add_argument('-d', '--duration', type=float, default=30.,
+                    help='The length of the synthetic solos in seconds.')
+    p.add_argument('-s', '--signals', type=str, nargs='+', default=SIGNALS, choices=SIGNALS,
+                    help='The kinds of notes of the solos.')
+    p.add_argument('-c', '--configs', type=str, nargs='+', default=CONFIGS,
+                    help='The configurations: backend[:name=value,...] with extract_melody '
+                         'arguments, e.g. yin:coarse=4 or melodia:block=30.')
+    p.add_argument('--bend', type=float, default=2.,
+                    help='The bend and slide interval in semitones.')
+    p.add_argument('--vibrato_rate', type=float, default=5.5,
+                    help='The vibrato rate in Hz.')
+    p.add_argument('--vibrato_depth', type=float, default=0.5,
+                    help='The vibrato depth in semitones.')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                    help='The number of runs per configuration (the fastest is reported).')
+    p.add_argument('-o', '--output', type=str, default=None,
+                    help='The JSON file of the results (default: stdout).')
+    return p.parse_args()
+
+def main(args):
+    results = benchmark(args.duration, args.signals, args.configs, args.repeat,
+                        bend=args.bend, vibrato_rate=args.vibrato_rate,
+                        vibrato_depth=args.vibrato_depth)
+    write_report(results, args.output, sampling_rate=SAMPLING_RATE, hop_length=HOP_LENGTH)
+
+if __name__ == '__main__':
+    args = parser()
+    main(args)
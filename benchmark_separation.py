@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+----------------------------------------------------------------------
+Benchmark of the source separation: time every stage of the adaptive
+REPET on synthetic mixtures, and the whole adaptive REPET and HPSS.
+----------------------------------------------------------------------
+The mixtures are a repeating accompaniment loop (bass, chord stabs and
+hi-hat) plus a non-repeating lead line. Every stage runs in a fresh
+Python process which synthesizes the mixture and runs the previous
+stages itself, so that its time and peak memory do not depend on the
+stages or mixtures measured before.
+
+Optional args:
+    Please refer to --help.
+----------------------------------------------------------------------
+Returns:
+    JSON list of results, one per mixture and stage:
+        stage, duration (s), fs (Hz), channels, compact,
+        time (s), throughput (seconds of audio per second),
+        peak_memory (MB above the memory of the inputs)
+
+"""
+import sys
+import numpy as np
+import monaural_source_separation as mss
+from benchmark_utils import time_isolated, write_report, BenchmarkError
+
+STAGES = ['stft', 'beat_spectrogram', 'repeating_periods', 'repeating_mask', 'istft', 'repet_ada', 'hpss']
+
+def synthesize_mixture(duration, fs, channels=2, seed=0):
+    """
+    Synthesize a repeating accompaniment loop plus a non-repeating lead line.
+
+    :param duration:  length of the mixture in seconds.
+    :param fs:        sampling frequency in Hz.
+    :param channels:  number of channels.
+    :param seed:      seed of the random generator.
+    :returns:         mixture [t samples, k channels] ([t samples] if mono).
+
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(duration*fs))/float(fs)
+    ### 2-second loop: bass on the beats, chord stabs on the off-beats, hi-hat on the eighths
+    loop_len = int(2*fs)
+    tl = np.arange(loop_len)/float(fs)
+    bass = np.sin(2*np.pi*55*tl)*np.exp(-np.mod(tl, 0.5)*6)
+    chord = sum(np.sin(2*np.pi*f*tl) for f in (220, 277.18, 329.63))/3.
+    chord *= (np.mod(tl-0.25, 0.5) < 0.1)
+    hihat = rng.randn(loop_len)*np.exp(-np.mod(tl, 0.25)*80)*0.3
+    loop = np.resize(bass + 0.5*chord + hihat, t.shape[0])
+    ### lead: random notes of random lengths with vibrato, never repeating the loop
+    lead = np.zeros(t.shape[0])
+    s = 0
+    while s < t.shape[0]:
+        e = min(t.shape[0], s + int(rng.uniform(0.15, 0.8)*fs))
+        f0 = 440*2**(rng.randint(-12, 13)/12.)
+        tn = t[s:e] - t[s]
+        phase = 2*np.pi*f0*tn + 0.5*np.sin(2*np.pi*5.5*tn)
+        lead[s:e] = (np.sin(phase) + 0.3*np.sin(2*phase))*np.exp(-tn*2)
+        s = e
+    ### channels: slightly different balance between the accompaniment and the lead
+    x = np.array([loop*(1-0.1*i) + 0.6*lead*(1+0.1*i) for i in range(channels)]).T
+    x /= np.max(np.abs(x))
+    return x[:,0] if channels == 1 else x
+
+def prepare_stages(x, fs, compact=False):
+    """
+    Run the adaptive REPET once and keep the inputs of every stage.
+
+    :param x:        mixture [t samples, k channels].
+    :param fs:       sampling frequency in Hz.
+    :param compact:  keep only the non-redundant bins in single precision.
+    :returns:        dict of stage name -> function without arguments.
+
+    """
+    N, win, stp, cof, per, par = mss.repet_ada_parameters(fs)
+    xc = x.reshape(x.shape[0], -1)
+    k = xc.shape[1]
+    n = int(N/2+1)
+    X = np.array([mss.stft(xc[:,i], win, stp, compact) for i in range(k)]).transpose(1, 2, 0)
+    V = abs(X[0:n,:,:])
+    V2 = np.mean(V**2, 2)
+    B = mss.beat_spectrogram(V2, par[0], par[1])
+    P = mss.repeating_periods(B, per)
+    M = [mss.repeating_mask(V[:,:,i], P, par[2]) for i in range(k)]
+    if not compact:
+        M = [np.concatenate((Mi, Mi[-2:0:-1,:]), 0) for Mi in M]
+    return {
+        'stft': lambda: [mss.stft(xc[:,i], win, stp, compact) for i in range(k)],
+        'beat_spectrogram': lambda: mss.beat_spectrogram(V2, par[0], par[1]),
+        'repeating_periods': lambda: mss.repeating_periods(B, per),
+        'repeating_mask': lambda: [mss.repeating_mask(V[:,:,i], P, par[2]) for i in range(k)],
+        'istft': lambda: [mss.istft(M[i]*X[:,:,i], win, stp) for i in range(k)],
+        'repet_ada': lambda: mss.repet_ada(x, fs, compact),
+        'hpss': lambda: mss.hpss(x, fs, compact),
+    }
+
+def stage_function(duration, fs, channels, compact, stage):
+    """
+    Build the inputs of a stage on a synthetic mixture (run by the worker process).
+
+    :returns:  function of the stage without arguments.
+
+    """
+    x = synthesize_mixture(duration, fs, channels)
+    return prepare_stages(x, fs, compact)[stage]
+
+def benchmark(durations, fs, channels, compact=False, stages=STAGES, repeat=3):
+    """
+    Benchmark the separation stages on synthetic mixtures of several lengths.
+
+    :param durations:  lengths of the mixtures in seconds.
+    :param fs:         sampling frequency in Hz.
+    :param channels:   number of channels.
+    :param compact:    keep only the non-redundant bins in single precision.
+    :param stages:     names of the stages to be timed.
+    :param repeat:     number of runs per stage.
+    :returns:          list of result dicts (with an error message for failed stages).
+
+    """
+    results = []
+    for duration in durations:
+        for stage in stages:
+            try:
+                elapsed, peak, _ = time_isolated('benchmark_separation', 'stage_function',
+                    {'duration': duration, 'fs': fs, 'channels': channels,
+                     'compact': compact, 'stage': stage}, repeat)
+            except BenchmarkError as e:
+                print >> sys.stderr, '  {:>18s} {:7.1f}s: failed, {}'.format(stage, duration, e)
+                results.append({'stage': stage, 'duration': duration, 'fs': fs,
+                                'channels': channels, 'compact': compact, 'error': str(e)})
+                continue
+            res = {'stage': stage, 'duration': duration, 'fs': fs,
+                   'channels': channels, 'compact': compact,
+                   'time': elapsed, 'throughput': duration/elapsed,
+                   'peak_memory': peak}
+            print >> sys.stderr, '  {stage:>18s} {duration:7.1f}s: {time:8.3f}s, ' \
+                '{throughput:8.1f}x real time, {peak_memory:8.1f} MB'.format(**res)
+            results.append(res)
+    return results
+
+def parser():
+    import argparse
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=
+    """
+===================================================================
+Script for benchmarking the source separation.
+===================================================================
+    """)
+    p.add_argument('-d', '--durations', type=float, nargs='+', default=[30., 120.],
+                    help='The lengths of the synthetic mixtures in seconds.')
+    p.add_argument('-s', '--sampling_rate', type=int, default=44100,
+                    help='The sampling frequency in Hz.')
+    p.add_argument('-c', '--channels', type=int, default=2,
+                    help='The number of channels.')
+    p.add_argument('--compact', action='store_true', default=False,
+                    help='Keep only the non-redundant bins in single precision.')
+    p.add_argument('--stages', type=str, nargs='+', default=STAGES, choices=STAGES,
+                    help='The stages to be timed.')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                    help='The number of runs per stage (the fastest is reported).')
+    p.add_argument('-o', '--output', type=str, default=None,
+                    help='The JSON file of the results (default: stdout).')
+    return p.parse_args()
+
+def main(args):
+    results = benchmark(args.durations, args.sampling_rate, args.channels,
+                        args.compact, args.stages, args.repeat)
+    write_report(results, args.output)
+
+if __name__ == '__main__':
+    args = parser()
+    main(args)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+----------------------------------------------------------------------
+Helpers of the benchmark scripts: time a function in a fresh Python
+process with its own peak memory, and write the JSON report.
+----------------------------------------------------------------------
+Every measurement runs in a new interpreter that builds its own inputs,
+so that neither its time nor its memory depends on what ran before
+(a forked process would reuse the pages freed by its parent). The peak
+memory is the high-water mark of the resident set above the resident
+set once the inputs are built, reset through /proc/self/clear_refs on
+Linux (ru_maxrss above the resident set elsewhere, which includes the
+peak of building the inputs).
+
+Usage of the worker process (see time_isolated):
+    benchmark_utils.py module factory kwargs repeat output
+"""
+import json, os, resource, subprocess, sys, tempfile, time, traceback
+import numpy as np
+
+class BenchmarkError(RuntimeError):
+    pass
+
+def _status(key):
+    ### entry of /proc/self/status in MB (None without procfs)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) / 2.**10
+    except IOError:
+        return None
+
+def _reset_peak():
+    """
+    :returns: current resident set in MB, from which the peak is measured.
+
+    """
+    try:
+        ### give the pages freed while building the inputs back to the system,
+        ### else the function reuses them without raising the resident set
+        import ctypes
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        ### reset the high-water mark VmHWM to the current resident set
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+    rss = _status('VmRSS')
+    return rss if rss is not None else 0.
+
+def _peak():
+    hwm = _status('VmHWM')
+    if hwm is not None:
+        return hwm
+    ### ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2.**20 if sys.platform == 'darwin' else 2.**10)
+
+def _worker(module, factory, kwargs, repeat, output):
+    try:
+        func = getattr(__import__(module), factory)(**json.loads(kwargs))
+        base = _reset_peak()
+        times = []
+        for _ in range(int(repeat)):
+            start = time.time()
+            res = func()
+            times.append(time.time() - start)
+        peak = _peak() - base
+        if isinstance(res, np.ndarray):
+            np.save(output + '.npy', res)
+        report = {'time': min(times), 'peak_memory': peak}
+    except BaseException:
+        report = {'error': traceback.format_exc().strip().splitlines()[-1]}
+    with open(output, 'w') as f:
+        json.dump(report, f)
+
+def time_isolated(module, factory, kwargs, repeat=3, timeout=None):
+    """
+    Time a function in a fresh Python process.
+
+    :param module:  name of the module of the factory (importable from this directory).
+    :param factory: name of a function of the module building the inputs and
+                    returning the function to be timed, without arguments.
+    :param kwargs:  JSON-serializable keyword arguments of the factory.
+    :param repeat:  number of runs (the fastest is reported).
+    :param timeout: seconds before the process is killed (no limit if None).
+    :returns:       time in seconds, peak memory in MB above the inputs and result
+                    of the last run if it is an array (else None).
+    :raises BenchmarkError: if the function raises, the process dies (e.g. out of
+                            memory) or it runs out of time.
+
+    """
+    fd, output = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    os.remove(output)
+    script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    with open(os.devnull, 'w') as null, tempfile.TemporaryFile() as err:
+        p = subprocess.Popen([sys.executable, script, module, factory, json.dumps(kwargs),
+                              str(repeat), output], stdout=null, stderr=err)
+        start = time.time()
+        while p.poll() is None:
+            if timeout is not None and time.time() - start > timeout:
+                p.kill()
+                p.wait()
+                raise BenchmarkError('timed out after {}s'.format(timeout))
+            time.sleep(0.05)
+        err.seek(0)
+        lines = err.read().strip().splitlines()
+    try:
+        with open(output) as f:
+            report = json.load(f)
+        os.remove(output)
+    except (IOError, ValueError):
+        raise BenchmarkError('the process died (exit code {}){}'.format(
+            p.returncode, ': ' + lines[-1] if lines else ''))
+    if 'error' in report:
+        raise BenchmarkError(report['error'])
+    res = None
+    if os.path.exists(output + '.npy'):
+        res = np.load(output + '.npy')
+        os.remove(output + '.npy')
+    return report['time'], report['peak_memory'], res
+
+def write_report(results, output=None, **info):
+    """
+    Write the results of a benchmark as JSON, with the numpy and python versions.
+
+    :param results: list of result dicts.
+    :param output:  the JSON file of the results (stdout if None).
+    :param info:    other entries of the report.
+
+    """
+    report = {'numpy': np.__version__, 'python': sys.version.split()[0]}
+    report.update(info)
+    report['results'] = results
+    if output is None:
+        print json.dumps(report, indent=2)
+    else:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    _worker(*sys.argv[1:])
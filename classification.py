@@ -14,6 +14,7 @@ import lasagne
 import pprint
 from guitar_trans import models
 from guitar_trans import parameters as pm
+from guitar_trans.melody_io import load_melody, EXT
 from lasagne import layers
 from sklearn.metrics import confusion_matrix, precision_score, recall_score, f1_score
 
@@ -66,7 +67,14 @@ def load_n_preprocess_input_feature(audio_dir, mc_dir, m_class, sep_direction=Fa
                 # print('file name: {}'.format(fi))
                 y, sr = rosa.load(os.path.join(root, fi), sr=pm.SAMPLING_RATE, mono=True)
                 fn = os.path.splitext(fi)[0]
-                mc = np.loadtxt(mc_dir+'/'+fn+'.MIDI.melody', dtype='float32')
+                ### <name>.mc, or <name>/Melody.mc as written by melody_extraction.py
+                mc_fps = [mc_dir+'/'+fn+EXT, mc_dir+'/'+fn+'/Melody'+EXT]
+                mc_fp = next((fp for fp in mc_fps if os.path.exists(fp)), None)
+                if mc_fp is not None:
+                    ### copy, since the edges are edited below
+                    mc = np.array(load_melody(mc_fp, 'midi'))
+                else:
+                    mc = np.loadtxt(mc_dir+'/'+fn+'.MIDI.melody', dtype='float32')
                 
                 ### Preprocess melody contour
                 if len(mc) < 18:
@@ -1,10 +1,14 @@
+from . import audio
 from . import contour
 from . import evaluation
+from . import melody_cache
+from . import melody_io
 from . import models
 from . import note
 from . import parameters
 from . import song
 from . import te_note_tracking
 from . import technique
+from . import yin
 
 # __version__ = '0.2.0'
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Audio decoding shared by the melody extraction and the transcription.
+
+The file is decoded and resampled once, to the analysis sampling rate of
+parameters.py, so that the pitch tracker and the candidate clipping see the
+same samples on the same HOP_LENGTH grid.
+"""
+import numpy as np
+import librosa as rosa
+import parameters as pm
+
+def load_audio(audio_fp, sr=None):
+    """
+    Decode an audio file to mono float32.
+
+    :param audio_fp: the path of the audio file.
+    :param sr:       sampling rate in Hz (SAMPLING_RATE of parameters.py if None).
+    :returns:        contiguous float32 samples and the sampling rate.
+
+    """
+    sr = pm.SAMPLING_RATE if sr is None else sr
+    audio, sr = rosa.load(audio_fp, sr=sr, mono=True, dtype=np.float32)
+    return np.ascontiguousarray(audio, dtype='float32'), sr
+
+def read_audio(audio_fp, start, stop, sr=None):
+    """
+    Decode a span of an audio file to mono float32, without decoding the rest.
+
+    :param audio_fp: the path of the audio file.
+    :param start:    first sample at the sampling rate sr.
+    :param stop:     sample after the last one at the sampling rate sr.
+    :param sr:       sampling rate in Hz (SAMPLING_RATE of parameters.py if None).
+    :returns:        contiguous float32 samples, fewer than stop-start at the end of the file.
+
+    """
+    sr = pm.SAMPLING_RATE if sr is None else sr
+    ### a few samples more, so that rounding of the decoder and resampler 
+    ### is not mistaken for the end of the file
+    audio, sr = rosa.load(audio_fp, sr=sr, mono=True, offset=start/float(sr),
+                          duration=(stop-start+64)/float(sr), dtype=np.float32)
+    return np.ascontiguousarray(audio[:stop-start], dtype='float32')
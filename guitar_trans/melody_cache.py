@@ -0,0 +1,126 @@
+"""
+On-disk cache of extracted melody contours.
+
+An entry is a binary melody contour file (see melody_io.py) named by the
+SHA-1 of the pitch tracker parameters and of the decoded audio, so the same
+audio processed with the same parameters.py settings is never run through
+MELODIA twice. The least recently used entries are removed once the cache grows
+beyond its size limit.
+"""
+import glob, hashlib, json, os
+import numpy as np
+from melody_io import melodia_params, save_melody, load_melody, EXT
+
+### default size limit in bytes
+MAX_SIZE = 256 * 2**20
+
+class MelodyCache(object):
+    def __init__(self, cache_dir, max_size=MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir): raise
+
+    def __repr__(self):
+        return 'MelodyCache(' + repr(self.cache_dir) + ', ' + repr(self.stats()) + ')'
+
+    def key(self, audio, params=None):
+        """
+        Key of decoded audio analysed with pitch tracker parameters.
+
+        :param audio:  decoded audio samples.
+        :param params: pitch tracker parameters (MELODIA of parameters.py if None).
+        :returns:      hex digest.
+
+        """
+        h = hashlib.sha1()
+        h.update(json.dumps(melodia_params() if params is None else params, sort_keys=True))
+        h.update(np.ascontiguousarray(audio, dtype='<f4').data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + EXT)
+
+    def get(self, key):
+        """
+        Look up an entry and mark it as recently used.
+
+        :param key: key of the entry.
+        :returns:   melody contour in Hz and in MIDI scale and pitch confidence 
+                    (None if not cached), or None on a miss.
+
+        """
+        fp = self.path(key)
+        try:
+            mc = load_melody(fp, 'hz', mmap=False)
+            mc_midi = load_melody(fp, 'midi', mmap=False)
+            try:
+                confidence = load_melody(fp, 'confidence', mmap=False)
+            except KeyError:
+                confidence = None
+            os.utime(fp, None)
+        except (IOError, OSError, ValueError, KeyError):
+            ### missing, evicted meanwhile by another process or unreadable
+            self.misses += 1
+            return None
+        self.hits += 1
+        return mc, mc_midi, confidence
+
+    def put(self, key, mc, mc_midi, params=None, confidence=None):
+        """
+        Add an entry and evict the least recently used ones beyond the size limit.
+
+        :param key:     key of the entry.
+        :param mc:      melody contour in Hz.
+        :param mc_midi: melody contour in MIDI scale.
+        :param params:  pitch tracker parameters (MELODIA of parameters.py if None).
+        :param confidence: pitch confidence (not cached if None).
+
+        """
+        fp = self.path(key)
+        ### write aside and rename, so that readers never see a partial entry
+        tmp = '{}.{}.tmp'.format(fp, os.getpid())
+        fields = [('hz', mc), ('midi', mc_midi)]
+        if confidence is not None:
+            fields.append(('confidence', confidence))
+        save_melody(tmp, fields, params=params)
+        os.rename(tmp, fp)
+        self.evict()
+
+    def entries(self):
+        """
+        :returns: list of (last use time, size, path) of the entries, least recent first.
+
+        """
+        entries = []
+        for fp in glob.glob(os.path.join(self.cache_dir, '*' + EXT)):
+            try:
+                st = os.stat(fp)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fp))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        size = sum(e[1] for e in entries)
+        for _, n, fp in entries:
+            if size <= self.max_size: break
+            try:
+                os.remove(fp)
+            except OSError:
+                pass
+            size -= n
+
+    def stats(self):
+        """
+        :returns: dict of hits, misses, number of entries and size in bytes.
+
+        """
+        entries = self.entries()
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(entries), 'size': sum(e[1] for e in entries)}
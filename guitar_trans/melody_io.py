@@ -0,0 +1,122 @@
+"""
+Binary melody contour files.
+
+A file is a small JSON header followed by the contours as little-endian
+float32 rows (one row per field, e.g. Hz and MIDI), so that a field can be
+memory-mapped without parsing the whole file:
+
+    MAGIC | header length (uint32) | JSON header (padded) | rows
+
+The header carries the hop size, the sampling rate, the number of frames,
+the names of the fields and the parameters of the pitch tracker (MELODIA
+unless stated otherwise by a 'backend' parameter).
+"""
+import json, os, struct
+import numpy as np
+import parameters as pm
+
+MAGIC = 'SLMC'
+VERSION = 1
+EXT = '.mc'
+### rows start on a 16-byte boundary
+ALIGN = 16
+
+def melodia_params():
+    """
+    MELODIA parameters of parameters.py as keyword arguments of PitchMelodia.
+
+    :returns: dict of parameter name -> value.
+
+    """
+    return {'harmonicWeight': pm.harmonicWeight, 'minDuration': pm.minDuration,
+            'binResolution': pm.binResolution, 'guessUnvoiced': pm.guessUnvoiced,
+            'frameSize': pm.frameSize, 'hopSize': pm.HOP_LENGTH,
+            'maxFrequency': pm.maxFrequency, 'minFrequency': pm.minFrequency,
+            'filterIterations': pm.filterIterations,
+            'magnitudeThreshold': pm.magnitudeThreshold,
+            'sampleRate': pm.SAMPLING_RATE,
+            'peakDistributionThreshold': pm.peakDistributionThreshold}
+
+def save_melody(fp, fields, hop_size=None, sr=None, params=None):
+    """
+    Save melody contours in the binary format.
+
+    :param fp:       the path of the file.
+    :param fields:   list of (name, contour) pairs of the same length.
+    :param hop_size: hop size in samples (hopSize of params if None).
+    :param sr:       sampling rate in Hz (sampleRate of params if None).
+    :param params:   pitch tracker parameters (MELODIA of parameters.py if None).
+
+    """
+    data = np.array([np.asarray(c, dtype='<f4') for _, c in fields], dtype='<f4')
+    if data.ndim != 2:
+        raise ValueError('The contours must be 1-D and of the same length.')
+    params = melodia_params() if params is None else params
+    header = {'version': VERSION,
+              'hop_size': int(params['hopSize'] if hop_size is None else hop_size),
+              'sample_rate': int(params['sampleRate'] if sr is None else sr),
+              'n_frames': data.shape[1],
+              'fields': [name for name, _ in fields],
+              'params': params}
+    text = json.dumps(header, sort_keys=True)
+    pad = -(len(MAGIC) + 4 + len(text)) % ALIGN
+    text += ' ' * pad
+    with open(fp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(text)))
+        f.write(text)
+        f.write(data.tostring())
+
+def read_header(fp):
+    """
+    Read the header of a binary melody contour file.
+
+    :param fp: the path of the file.
+    :returns:  header dict, with the byte offset of the rows as 'offset'.
+
+    """
+    with open(fp, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a melody contour file.'.format(fp))
+        n, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(n))
+    if header['version'] > VERSION:
+        raise ValueError('{} has an unsupported version {}.'.format(fp, header['version']))
+    header['offset'] = len(MAGIC) + 4 + n
+    return header
+
+def load_melody(fp, field='midi', mmap=True):
+    """
+    Load a melody contour of a binary file.
+
+    :param fp:    the path of the file.
+    :param field: the name of the contour (e.g. 'hz' or 'midi').
+    :param mmap:  memory-map the contour instead of reading it.
+    :returns:     float32 contour (read-only if memory-mapped).
+
+    """
+    header = read_header(fp)
+    if field not in header['fields']:
+        raise KeyError('{} has no field {}.'.format(fp, field))
+    n = header['n_frames']
+    offset = header['offset'] + header['fields'].index(field) * n * 4
+    if n == 0:
+        return np.zeros(0, dtype='float32')
+    if mmap:
+        return np.memmap(fp, dtype='<f4', mode='r', offset=offset, shape=(n,))
+    with open(fp, 'rb') as f:
+        f.seek(offset)
+        return np.fromfile(f, dtype='<f4', count=n)
+
+def load_contour(fp, field='midi'):
+    """
+    Load a melody contour of a binary file, or of a text file of one value per line.
+
+    :param fp:    the path of the file (binary if it has the extension EXT).
+    :param field: the name of the contour in a binary file.
+    :returns:     float32 contour of a binary file, float64 contour of a text file.
+
+    """
+    if os.path.splitext(fp)[1] == EXT:
+        return load_melody(fp, field)
+    return np.loadtxt(fp)
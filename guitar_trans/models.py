@@ -7,7 +7,7 @@ import lasagne
 import pprint
 from lasagne import layers
 from sklearn.metrics import confusion_matrix
-from parameters import MC_LENGTH, SAMPLING_RATE, HOP_LENGTH
+from parameters import MC_LENGTH, SAMPLING_RATE, HOP_LENGTH, N_FFT
 
 #===== FUNCTIONS =====#
 
@@ -53,7 +53,7 @@ class MFCCFeature(Feature):
             print(mc)
             return None
         n_mfcc = 13
-        mfcc = rosa.feature.mfcc(y, sr=SAMPLING_RATE, n_mfcc=n_mfcc, n_fft=512, hop_length=HOP_LENGTH)
+        mfcc = rosa.feature.mfcc(y, sr=SAMPLING_RATE, n_mfcc=n_mfcc, n_fft=N_FFT, hop_length=HOP_LENGTH)
         mfcc_d = rosa.feature.delta(mfcc)
         mfcc_d2 = rosa.feature.delta(mfcc, order=2)
         # feat_all = np.concatenate((mfcc, mfcc_d, mfcc_d2), axis=0).astype('float32')
@@ -68,7 +68,7 @@ class SpecFeature(Feature):
             print('nan in {}.'.format(fn))
             return None
         n_mels = 128
-        melspec = rosa.feature.melspectrogram(y, sr=SAMPLING_RATE, n_fft=512, hop_length=HOP_LENGTH, n_mels=n_mels)
+        melspec = rosa.feature.melspectrogram(y, sr=SAMPLING_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH, n_mels=n_mels)
         feat_all = np.concatenate((melspec, np.array([mc]), np.array([dmc])), axis=0).astype('float32')
         return (feat_all, fn) if ans is None else (feat_all, ans, fn)
 
@@ -81,10 +81,10 @@ class CocktailFeature(Feature):
             return None
         n_mels = 128
         n_mfcc = 13
-        mfcc = rosa.feature.mfcc(y, sr=SAMPLING_RATE, n_mfcc=n_mfcc, n_fft=512, hop_length=HOP_LENGTH)
+        mfcc = rosa.feature.mfcc(y, sr=SAMPLING_RATE, n_mfcc=n_mfcc, n_fft=N_FFT, hop_length=HOP_LENGTH)
         mfcc_d = rosa.feature.delta(mfcc)
         mfcc_d2 = rosa.feature.delta(mfcc, order=2)
-        melspec = rosa.feature.melspectrogram(y, sr=SAMPLING_RATE, n_fft=512, hop_length=HOP_LENGTH, n_mels=n_mels)
+        melspec = rosa.feature.melspectrogram(y, sr=SAMPLING_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH, n_mels=n_mels)
         feat_all = np.concatenate((mfcc, mfcc_d, mfcc_d2, melspec, np.array([nmc]), np.array([dmc])), axis=0).astype('float32')
         return (feat_all, fn) if ans is None else (feat_all, ans, fn)
 
@@ -132,9 +132,14 @@ cv_list =  [[5, 17, 32, 50, 55, 57, 58, 65, 70],
 
 #=====PARAMETERS OF MELODY CONTOUR=====#
 MC_LENGTH = 25
-HOP_LENGTH = 256
+### Analysis sampling rate of the melody extraction, the clips and the features.
+### E.g. 22050 roughly halves their cost, guitar leads sit well below 11 kHz.
+### Hop, frame and FFT sizes scale with it so that frames keep their duration,
+### but the models have to be trained at the same rate.
 SAMPLING_RATE = 44100
-frameSize = 2048
+HOP_LENGTH = 256 * SAMPLING_RATE // 44100
+frameSize = 2048 * SAMPLING_RATE // 44100
+N_FFT = 512 * SAMPLING_RATE // 44100
 guessUnvoiced = True
 binResolution = 10
 minDuration = 100
@@ -143,4 +148,9 @@ filterIterations = 2
 magnitudeThreshold = 20
 peakDistributionThreshold = 0.75
 minFrequency = 82
-maxFrequency = 20000
\ No newline at end of file
+maxFrequency = min(20000, SAMPLING_RATE // 2)
+
+#=====PARAMETERS OF YIN (frameSize, minFrequency shared with MELODIA)=====#
+yinThreshold = 0.15
+yinMaxFrequency = 1500
+yinSilence = -60
\ No newline at end of file
@@ -1,10 +1,11 @@
 import numpy as np
 from note import Note
+from parameters import SAMPLING_RATE, HOP_LENGTH
 from technique import *
 from os import path
 
 class Song:
-	def __init__(self, sr=44100, hop=256, raw_audio=None, 
+	def __init__(self, sr=SAMPLING_RATE, hop=HOP_LENGTH, raw_audio=None, 
 				 es_note_list=None, melody=None, 
 				 smooth_melody=None, name=None):
 		self.sr = sr
@@ -1,10 +1,10 @@
 import numpy as np
-import operator
 import parameters as pm
 from contour import *
 from technique import *
 from note import *
 from scipy.stats import norm
+from numpy.lib.stride_tricks import as_strided
 from os import sep
 
 #=====Parameters=====#
@@ -17,76 +17,111 @@ max_cont_diff=0.8
 max_cand_diff=3.5
 max_cs_amp=3.0
 max_cs_length=33
+max_mean_diff=0.5
+### frames of lower pitch confidence are unvoiced (MELODIA: negative)
+min_confidence=0.0
 
 nf_weights = np.array([norm.pdf(i, scale=2) for i in range(-5, 6)])
 nf_weights /= nf_weights.sum()
 
-def conditioned_norm_filter(data):
+def unvoice(data, confidence):
+    ### Set the pitch of frames under min_confidence to 0
+    data = np.array(data)
+    data[np.asarray(confidence) <= min_confidence] = 0
+    return data
+
+def voiced_spans(data):
+    ### Index of the voiced regions: [start, end) of the runs of frames of at least min_pitch
+    voiced = np.r_[False, np.asarray(data) >= min_pitch, False]
+    return np.flatnonzero(voiced[1:] != voiced[:-1]).reshape(-1, 2)
+
+def submelodies(data):
+    ### Split the filtered melody into submelodies: [start, end) of the runs of 
+    ### frames of at least min_pitch without a jump over max_cont_diff, of at 
+    ### least min_melo_len frames. Unvoiced frames of the filtered melody are 0,
+    ### so a run never continues into them as long as max_cont_diff < min_pitch.
+    data = np.asarray(data)
+    voiced = data >= min_pitch
+    brk = ~voiced[1:] | ~voiced[:-1] | (np.abs(np.diff(data)) > max_cont_diff)
+    edges = np.r_[0, np.flatnonzero(brk) + 1, len(data)]
+    bounds = np.column_stack((edges[:-1], edges[1:]))
+    bounds = bounds[bounds[:,1] - bounds[:,0] >= min_melo_len]
+    bounds = bounds[voiced[bounds[:,0]]]
+    ### Candidate transitions: a submelody right after the previous one, closed by 
+    ### a break within max_cand_diff of it (not the last one running to the end)
+    ### [submelody index, sign of the transition]
+    start, prev_end = bounds[1:,0], bounds[:-1,1]
+    jump = data[start] - data[prev_end - 1]
+    is_cand = (prev_end == start) & (np.abs(jump) < max_cand_diff) & (bounds[1:,1] < len(data))
+    idx = np.flatnonzero(is_cand) + 1
+    cands = np.column_stack((idx, np.where(jump[idx-1] >= 0, 1, -1)))
+    return bounds, cands
+
+def conditioned_norm_filter(data, spans=None):
+    ### Gaussian-weighted mean of the neighbours of every voiced frame, over 
+    ### the voiced neighbours within max_cont_diff, renormalized by their weights
+    data = np.asarray(data)
     new_data = np.zeros(data.shape)
     h_fil = len(nf_weights) / 2
-    for i in range(len(data)):
-        if data[i] < min_pitch: continue
-        v = np.array([ data[i-j] if ( 0 <= i-j < len(data) and \
-                                      data[i-j] >= min_pitch and \
-                                      np.abs(data[i-j] - data[i]) <= max_cont_diff \
-                                    ) else 0
-                       for j in range(-h_fil, h_fil + 1)])
-        w_sum = np.extract(v != 0, nf_weights).sum()
-        new_data[i] = (v * nf_weights).sum() / w_sum
+    if spans is None: spans = voiced_spans(data)
+    if len(spans) == 0: return new_data
+    idx = np.concatenate([np.arange(start, end) for start, end in spans])
+    ### Neighbourhood data[i+h_fil], ..., data[i-h_fil] of every frame, unvoiced out of range
+    padded = np.concatenate((np.zeros(h_fil), data, np.zeros(h_fil)))
+    win = as_strided(padded, (len(data), 2*h_fil+1), (padded.strides[0],)*2)[idx, ::-1]
+    cond = (win >= min_pitch) & (np.abs(win - data[idx,None]) <= max_cont_diff)
+    v = np.where(cond, win, 0)
+    ### Sum of the weights of every neighbourhood pattern, once per pattern and 
+    ### over the selected weights only, as rounding must not break plateaus
+    bits = 1 << np.arange(2*h_fil+1)
+    patterns, inv = np.unique(cond.dot(bits), return_inverse=True)
+    w_sum = np.array([np.extract(p & bits, nf_weights).sum() for p in patterns])
+    new_data[idx] = (v * nf_weights).sum(axis=1) / w_sum[inv]
     return new_data
 
-def conditioned_mean_filter(data, filter_size=5):
+def conditioned_mean_filter(data, filter_size=5, max_diff=None, low=None):
+    ### Mean of the neighbours of every frame of at least low (min_pitch), 
+    ### over the neighbours of at least low within max_diff (max_mean_diff)
     if filter_size % 2 == 0:
         filter_size += 1
         print('Filter size should be odd. Set filer size to {}.'.format(filter_size))
+    max_diff = max_mean_diff if max_diff is None else max_diff
+    low = min_pitch if low is None else low
+    data = np.asarray(data)
     new_data = np.zeros(data.shape)
     h_fil = filter_size / 2
-    for i in range(len(data)):
-        if data[i] < min_pitch: continue
-        v = np.array([data[i-j] for j in range(-h_fil, h_fil + 1)
-                        if 0 <= i-j < len(data) and \
-                        data[i-j] >= min_pitch and \
-                        abs(data[i-j] - data[i]) <= 0.5
-                     ], dtype=float)
-        new_data[i] = round(v.mean(), 4)
+    idx = np.flatnonzero(~(data < low))
+    ### Neighbourhood data[i+h_fil], ..., data[i-h_fil] of every frame, never selected out of range
+    padded = np.concatenate((np.full(h_fil, -np.inf), data, np.full(h_fil, -np.inf)))
+    win = as_strided(padded, (len(data), filter_size), (padded.strides[0],)*2)
+    ### Frames per batch, bounds the memory of large filters on long contours
+    step = max(1, 2**20 / filter_size)
+    for s in range(0, len(idx), step):
+        i = idx[s:s+step]
+        v = win[i, ::-1]
+        cond = (v >= low) & (np.abs(v - data[i,None]) <= max_diff)
+        mean = np.where(cond, v, 0).sum(axis=1) / cond.sum(axis=1)
+        new_data[i] = np.round(mean, 4)
+        ### np.round scales by 10**4, round() is exact on the ties
+        tie = np.flatnonzero(np.abs(mean * 1e4 % 1 - 0.5) < 1e-6)
+        new_data[i[tie]] = [round(m, 4) for m in mean[tie]]
     return new_data
 
 ### Technique Embedded Note Tracking
-def tent(melody, debug=None):
+def tent(melody, debug=None, confidence=None):
     if melody.length == 0:
         print 'Nothing in melody. (Length of melody is 0.)'
         return
+    seq = melody.seq if confidence is None else unvoice(melody.seq, confidence)
+    spans = voiced_spans(seq)
     melody = Contour(melody.start_idx, 
-                     conditioned_norm_filter(melody.seq)
+                     conditioned_norm_filter(seq, spans)
                     )
-    submelo_list = []
-    sub_idx = 0
-    submelo = []
-    melody_cand_dict = {}
-    for i in range(melody.length):
-        if len(submelo) == 0:
-            if melody[i] >= min_pitch:
-                sub_idx = i
-                submelo.append(melody[i])
-        elif abs(melody[i] - submelo[-1]) <= max_cont_diff:
-            submelo.append(melody[i])
-        else:
-            if len(submelo) >= min_melo_len:
-                ct = Contour(sub_idx, submelo)
-                if len(submelo_list) > 0 and \
-                   submelo_list[-1].end_idx + 1 == sub_idx and \
-                   abs(submelo[0] - submelo_list[-1][-1]) < max_cand_diff:
-                    ### Select as Candidate
-                    sign = 1 if submelo[0] >= submelo_list[-1][-1] else -1
-                    melody_cand_dict[len(submelo_list)] = (sign, sub_idx)
-                submelo_list.append(ct)
-            submelo = []
-            if melody[i] >= min_pitch:
-                sub_idx = i
-                submelo.append(melody[i])
-    if len(submelo) >= min_melo_len:
-        ct = Contour(sub_idx, submelo)
-        submelo_list.append(ct)
+    bounds, cands = submelodies(melody.seq)
+    submelo_list = [Contour(start, melody.seq[start:end]) for start, end in bounds]
+    ### Sign of the candidate transition into every submelody, 0 if none
+    cand_sign = np.zeros(len(bounds), dtype=int)
+    cand_sign[cands[:,0]] = cands[:,1]
 
     trend = np.zeros(melody.length)
     if debug is not None: mid_trend = np.zeros(melody.length)
@@ -97,8 +132,8 @@ def tent(melody, debug=None):
         if debug is not None: mid_trend[subm.start_idx:subm.start_idx+len(tr)] = list(tr)
         nt = get_notes(subm, tr)
         ### Add candidate between submelodies
-        if idx in melody_cand_dict.keys():
-            sign, sub_idx = melody_cand_dict[idx]
+        if cand_sign[idx] != 0:
+            sign, sub_idx = cand_sign[idx], subm.start_idx
             seg_pos = max(0, sub_idx - pm.MC_LENGTH/2 - notes[-1].onset)
             seg = Segment(sign, seg_pos, pm.MC_LENGTH, melody)
             notes[-1].segs.append(seg)
@@ -112,6 +147,126 @@ def tent(melody, debug=None):
         np.savetxt(debug+sep+'MidTrend.txt', mid_trend)
     return trend, melody, notes
 
+class TentTracker(object):
+    ### Online TENT: the melody contour is pushed chunk by chunk, and the notes
+    ### of a submelody are returned as soon as it is closed. Only the open 
+    ### submelody, the context of the filter and the last submelody (while the 
+    ### next one can still be a candidate transition from it) are kept, so the 
+    ### memory does not grow with the length of the song. The notes are the ones 
+    ### of tent, except that candidate segments between submelodies refer to a 
+    ### window of the filtered melody starting at the onset of their note.
+    def __init__(self):
+        self.n_frames = 0
+        ### raw frames from raw_start, the n_filtered first frames being filtered
+        self._raw = None
+        self._raw_start = 0
+        self._n_filtered = 0
+        ### open run of the filtered melody
+        self._run = None
+        ### last submelody while the next one may be a candidate, and its last note
+        self._last = None
+        self._held = []
+
+    def push(self, seq, confidence=None):
+        """
+        Add frames of the melody contour.
+
+        :param seq:        chunk of the melody contour in MIDI scale.
+        :param confidence: pitch confidence of the chunk (all frames kept if None).
+        :returns:          list of the notes finalized by the chunk.
+
+        """
+        seq = np.asarray(seq) if confidence is None else unvoice(seq, confidence)
+        self._raw = seq if self._raw is None else np.r_[self._raw, seq]
+        self.n_frames += len(seq)
+        h_fil = len(nf_weights) / 2
+        ### Frames with their whole filter neighbourhood
+        stop = self.n_frames - h_fil
+        if stop <= self._n_filtered:
+            return []
+        filtered = conditioned_norm_filter(self._raw)[self._n_filtered - self._raw_start:stop - self._raw_start]
+        notes = self._segment(filtered, self._n_filtered)
+        self._n_filtered = stop
+        start = max(0, stop - h_fil)
+        self._raw = self._raw[start - self._raw_start:]
+        self._raw_start = start
+        return notes
+
+    def flush(self):
+        """
+        End the melody contour and reset the tracker.
+
+        :returns: list of the remaining notes.
+
+        """
+        notes = []
+        if self._raw is not None:
+            filtered = conditioned_norm_filter(self._raw)[self._n_filtered - self._raw_start:]
+            notes = self._segment(filtered, self._n_filtered, end=True)
+        notes += self._held
+        self.__init__()
+        return notes
+
+    def _segment(self, filtered, start, end=False):
+        ### Runs of the filtered frames following the open run, as in submelodies
+        if self._run is not None:
+            data = np.r_[self._run.seq, filtered]
+            start = self._run.start_idx
+        else:
+            data = filtered
+        if len(data) == 0:
+            return []
+        voiced = data >= min_pitch
+        brk = ~voiced[1:] | ~voiced[:-1] | (np.abs(np.diff(data)) > max_cont_diff)
+        edges = np.r_[0, np.flatnonzero(brk) + 1, len(data)]
+        self._run = None
+        if not end and len(data) > 0 and voiced[-1]:
+            self._run = Contour(start + edges[-2], data[edges[-2]:])
+            edges = edges[:-1]
+        notes = []
+        for s, e in zip(edges[:-1], edges[1:]):
+            kept = voiced[s] and e - s >= min_melo_len
+            ### Every run follows the last submelody until one is kept
+            if self._last is not None and not kept:
+                self._last = None
+                notes += self._held
+                self._held = []
+            if not kept:
+                continue
+            subm = Contour(start + s, data[s:e])
+            nt = get_notes(subm, melody_2_trend(subm))
+            ### The last submelody running to the end of the melody is no candidate
+            if self._last is not None and (e < len(data) or not end) and \
+               abs(data[s] - self._last[-1]) < max_cand_diff:
+                ### Add candidate between submelodies
+                sign = 1 if data[s] >= self._last[-1] else -1
+                last_note = self._held[-1]
+                seg_pos = max(0, subm.start_idx - pm.MC_LENGTH/2 - last_note.onset)
+                window = Contour(last_note.onset, np.r_[self._last.seq[last_note.onset - self._last.start_idx:], subm.seq])
+                last_note.segs.append(Segment(sign, seg_pos, pm.MC_LENGTH, window))
+                last_note.next_note = nt[0]
+            notes += self._held + nt[:-1]
+            self._held = nt[-1:]
+            self._last = subm
+        return notes
+
+def tent_stream(chunks):
+    ### Notes of a melody contour given chunk by chunk, as soon as they are final.
+    ### A chunk is a sequence of MIDI pitches, a pair of it and its pitch confidence,
+    ### or a (Hz, MIDI, confidence) triple of extract_melody_stream.
+    tracker = TentTracker()
+    for chunk in chunks:
+        if not isinstance(chunk, tuple):
+            seq, confidence = chunk, None
+        elif len(chunk) == 3:
+            _, seq, confidence = chunk
+        else:
+            seq, confidence = chunk
+        for nt in tracker.push(seq, confidence):
+            yield nt
+    for nt in tracker.flush():
+        yield nt
+
 def melody_2_trend(melody):
     extrema = get_extrema(melody.seq)
     ### If the difference in this melody is smaller than min_vib_amp, 
@@ -120,55 +275,58 @@ def melody_2_trend(melody):
         return [0] * melody.length
 
     ### Record the trend (ascending, descending, or horizontal)
-    trend = np.zeros(melody.length)
-    for i in range(len(extrema)-1):
-        j, j_val, _ = extrema[i]
-        k, k_val, _ = extrema[i+1]
-        j, k = int(j), int(k)
-        pattern = Contour(j, melody[j:k])
-        trend[j:k] = scan_pattern_trend(pattern, melody[int(k)])
+    trend = scan_trends(melody.seq, extrema[:,0].astype(int))
     trend[-1] = trend[-2] 
     return trend
 
 def scan_pattern_trend(pattern, next_extreme, alpha=0.5):
-    pattern_diff = next_extreme - pattern[0]
-    trend = [0] * pattern.length
-    ### Trace the pattern that is possible to find techs and highlight the part of slope
-    if (abs(pattern_diff) >= min_vib_amp):
-        ### Decide the direction of pattern
-        if pattern_diff >= 0: ### ascending pattern
-            trend_type = 1
-            opt = operator.gt
-        elif pattern_diff < 0: ### descending pattern
-            trend_type = -1
-            opt = operator.lt
-        else:
-            raise ValueError("Direction must either be \'up\' or \'down\'")
-
-        ### Find place with slope larger than average slope
-        slope = alpha * pattern_diff / pattern.length
-        accu_plain = 0
-        trend = [0] * pattern.length
-        plain_thres = min(pattern.length/3, 18)
-        m = end_m = start_m = 0
-        while m < pattern.length-1:
-            if opt(pattern[m+1] - pattern[m], slope):
-                end_m = m + 1
-                if accu_plain > 0: 
-                    accu_plain = 0
-            else:
-                accu_plain += 1
-                if accu_plain == plain_thres:
-                    if end_m > start_m and \
-                       abs(pattern[end_m] - pattern[start_m]) >= min_cs_amp:
-                        trend[start_m:end_m] = [trend_type] * (end_m  - start_m)
-                    start_m = end_m
-                if end_m == start_m:
-                    start_m = end_m = m + 1
-            m += 1
-        if accu_plain < plain_thres and abs(next_extreme - pattern[start_m]) >= min_vib_amp:
-            end_m = pattern.length
-            trend[start_m:end_m] = [trend_type] * (end_m  - start_m)
+    seq = np.r_[pattern.seq, next_extreme]
+    return list(scan_trends(seq, np.array([0, pattern.length]), alpha)[:-1])
+
+def scan_trends(seq, bounds, alpha=0.5):
+    ### Trend of the patterns seq[j:k] between consecutive bounds j, k, each 
+    ### heading for the next extreme seq[k]. The steps steeper than alpha times 
+    ### the average slope of their pattern are grouped until a plateau of 
+    ### plain_thres steps: a closed group is a slope if it spans min_cs_amp, the 
+    ### group still open at the end of the pattern runs up to the next extreme 
+    ### if it is min_vib_amp away from it.
+    seq = np.asarray(seq)
+    trend = np.zeros(len(seq))
+    j, k = bounds[:-1], bounds[1:]
+    length = k - j
+    pattern_diff = seq[k] - seq[j]
+    trend_type = np.where(pattern_diff >= 0, 1, -1)
+    slope = alpha * pattern_diff / length
+    plain_thres = np.minimum(length/3, 18)
+    ### No plateau can close a group when plain_thres is 0
+    valid = (np.abs(pattern_diff) >= min_vib_amp) & (plain_thres > 0)
+
+    ### Steep steps m -> m+1 of all patterns, the step into the next extreme excluded
+    frames = np.arange(bounds[0], bounds[-1])
+    pat = np.repeat(np.arange(len(length)), length)
+    step = seq[frames+1] - seq[frames]
+    steep = np.where(trend_type[pat] > 0, step > slope[pat], step < slope[pat])
+    steep &= valid[pat] & (frames + 1 < k[pat])
+
+    ### Runs of steep steps [start, end), never across patterns
+    edges = np.flatnonzero(np.diff(np.r_[False, steep, False]))
+    runs = edges.reshape(-1, 2) + bounds[0]
+    if len(runs) == 0: return trend
+    run_pat = pat[runs[:,0] - bounds[0]]
+    ### A group starts after a plateau of plain_thres steps or in a new pattern
+    first = np.r_[True, (run_pat[1:] != run_pat[:-1]) | 
+                        (runs[1:,0] - runs[:-1,1] >= plain_thres[run_pat[1:]])]
+    last = np.r_[first[1:], True]
+    start, end, g_pat = runs[first,0], runs[last,1], run_pat[first]
+    ### The last group of a pattern is closed by a plateau before the next extreme
+    closed = np.r_[g_pat[1:] == g_pat[:-1], False] | \
+             (k[g_pat] - 1 - end >= plain_thres[g_pat])
+    slope_cond = closed & (np.abs(seq[end] - seq[start]) >= min_cs_amp)
+    open_cond = ~closed & (np.abs(seq[k[g_pat]] - seq[start]) >= min_vib_amp)
+    end = np.where(closed, end, k[g_pat])
+    for s, e, t in zip(start[slope_cond | open_cond], end[slope_cond | open_cond], 
+                       trend_type[g_pat[slope_cond | open_cond]]):
+        trend[s:e] = t
     return trend
 
 def get_notes(melody, trend):
@@ -0,0 +1,86 @@
+"""
+Pitch tracking with YIN, vectorized over frames with NumPy.
+
+A lightweight alternative to essentia's PitchMelodia for monophonic
+recordings such as DI guitar tracks. Yin() is called like PitchMelodia,
+on mono float32 audio at the analysis sampling rate, and returns the
+pitch in Hz (0 for unvoiced frames) and a confidence per frame, with
+frame i centred on sample i*hopSize.
+
+A. de Cheveigne and H. Kawahara. YIN, a fundamental frequency estimator
+for speech and music. JASA, 2002.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import parameters as pm
+
+class Yin(object):
+    def __init__(self, frameSize=None, hopSize=None, sampleRate=None, minFrequency=None,
+                 maxFrequency=None, threshold=None, silence=None, batch=1024):
+        self.params = {
+            'backend': 'yin',
+            'frameSize': pm.frameSize if frameSize is None else frameSize,
+            'hopSize': pm.HOP_LENGTH if hopSize is None else hopSize,
+            'sampleRate': pm.SAMPLING_RATE if sampleRate is None else sampleRate,
+            'minFrequency': pm.minFrequency if minFrequency is None else minFrequency,
+            'maxFrequency': pm.yinMaxFrequency if maxFrequency is None else maxFrequency,
+            'threshold': pm.yinThreshold if threshold is None else threshold,
+            'silence': pm.yinSilence if silence is None else silence}
+        ### frames per FFT batch, bounds the memory of long files
+        self.batch = batch
+
+    def __repr__(self):
+        return 'Yin(' + repr(self.params) + ')'
+
+    def __call__(self, audio):
+        """
+        Estimate the pitch of every frame.
+
+        :param audio: mono samples.
+        :returns:     pitch in Hz (0 if unvoiced) and confidence, float32 [n frames].
+
+        """
+        prm = self.params
+        W, hop, sr = prm['frameSize'], prm['hopSize'], prm['sampleRate']
+        tau_max = min(int(np.ceil(sr / float(prm['minFrequency']))), W // 2)
+        tau_min = max(1, int(np.floor(sr / float(prm['maxFrequency']))))
+        ### integration window and FFT length of the autocorrelation without wrap-around
+        w = W - tau_max
+        nfft = int(2**np.ceil(np.log2(W + w)))
+        x = np.asarray(audio, dtype='float64').ravel()
+        n = 1 + len(x) // hop
+        xp = np.pad(x, (W//2, W//2), 'constant')
+        frames = as_strided(xp, (n, W), (xp.strides[0]*hop, xp.strides[0]))
+        pitch = np.zeros(n, dtype='float32')
+        confidence = np.zeros(n, dtype='float32')
+        taus = np.arange(tau_max+1)
+        for s in range(0, n, self.batch):
+            F = frames[s:s+self.batch]
+            ### difference function d(tau) = e(0) + e(tau) - 2 r(tau)
+            r = np.fft.irfft(np.fft.rfft(F, nfft) * np.conj(np.fft.rfft(F[:,:w], nfft)), nfft)[:,:tau_max+1]
+            cs = np.concatenate((np.zeros((F.shape[0], 1)), np.cumsum(F**2, axis=1)), axis=1)
+            e = cs[:, w + taus] - cs[:, taus]
+            d = np.maximum(e[:,:1] + e - 2*r, 0)
+            ### cumulative mean normalized difference
+            cm = np.cumsum(d[:,1:], axis=1)
+            c = np.ones_like(d)
+            np.divide(d[:,1:] * taus[1:], cm, out=c[:,1:], where=cm > 0)
+            ### first local minimum under the threshold, else the global minimum (unvoiced)
+            t = np.arange(tau_min, tau_max)
+            ct = c[:, t]
+            dips = (ct < prm['threshold']) & (ct < c[:, t-1]) & (ct <= c[:, t+1])
+            voiced = dips.any(axis=1)
+            i = np.where(voiced, dips.argmax(axis=1), ct.argmin(axis=1))
+            rows = np.arange(F.shape[0])
+            tau = t[i]
+            ### parabolic interpolation of the period
+            a, b, z = c[rows, tau-1], c[rows, tau], c[rows, tau+1]
+            den = a - 2*b + z
+            shift = np.zeros_like(den)
+            np.divide(a - z, 2*den, out=shift, where=den > 0)
+            ### silent frames are unvoiced
+            level = 10*np.log10(e[:,0] / w + 1e-20)
+            voiced &= level > prm['silence']
+            pitch[s:s+F.shape[0]] = np.where(voiced, sr / (tau + np.clip(shift, -1, 1)), 0)
+            confidence[s:s+F.shape[0]] = np.clip(1 - b, 0, 1)
+        return pitch, confidence
@@ -1,4 +1,3 @@
-import librosa as rosa
 import numpy as np
 import guitar_trans.te_note_tracking as note_tracking
 import guitar_trans.parameters as pm
@@ -8,16 +7,19 @@ from guitar_trans.note import *
 from guitar_trans.contour import *
 from guitar_trans.technique import *
 from guitar_trans.evaluation import evaluation_note, evaluation_esn, evaluation_ts
-from melody_extraction import extract_melody
+from guitar_trans.audio import load_audio
+from guitar_trans.melody_io import load_contour, read_header, EXT
+from guitar_trans.melody_cache import MelodyCache, MAX_SIZE
+from melody_extraction import extract_melody, BACKENDS
 from os import path, sep, makedirs
 
-N_BIN = int(round(0.14 * 44100))
+N_BIN = int(round(0.14 * pm.SAMPLING_RATE))
 N_FRAME = pm.MC_LENGTH
 
-def transcribe(audio, melody, asc_model_fp, desc_model_fp, save_dir, audio_fn):
+def transcribe(audio, melody, asc_model_fp, desc_model_fp, save_dir, audio_fn, confidence=None):
     if not path.exists(save_dir): makedirs(save_dir)
     print '  Output directory: ', '\n', '    ', save_dir
-    trend, new_melody, notes = note_tracking.tent(melody, debug=save_dir)
+    trend, new_melody, notes = note_tracking.tent(melody, debug=save_dir, confidence=confidence)
     np.savetxt(save_dir+sep+'FilteredMelody.txt', new_melody.seq, fmt='%.8f')
     np.savetxt(save_dir+sep+'TentNotes.txt', [n.discrete_to_cont(pm.HOP_LENGTH, pm.SAMPLING_RATE).array_repr() for n in notes], fmt='%.8f')
     cand_dict = {pm.D_ASCENDING: [], pm.D_DESCENDING: []}
@@ -112,16 +114,27 @@ def get_tech(t_name, direction):
     else:
         raise ValueError("t_name shouldn't be {}.".format(t_name))
 
-def main(audio_fp, asc_model_fp, desc_model_fp, output_dir, mc_fp=None, eval_note=None, eval_ts=None):
+def main(audio_fp, asc_model_fp, desc_model_fp, output_dir, mc_fp=None, eval_note=None, eval_ts=None,
+         cache_dir=None, cache_size=MAX_SIZE, backend='melodia', coarse=None, voiced_only=False):
     audio_fn = path.splitext(path.basename(audio_fp))[0]
     save_dir = path.join(output_dir, audio_fn)
+    ### decode once at SAMPLING_RATE for both the pitch tracker and the clipping
+    audio, sr = load_audio(audio_fp)
     if mc_fp is None:
-        mc, mc_midi = extract_melody(audio_fp, save_dir)
+        cache = MelodyCache(cache_dir, cache_size) if cache_dir is not None else None
+        mc, mc_midi, confidence = extract_melody(audio_fp, save_dir, cache=cache, audio=audio,
+                                                 backend=backend, coarse=coarse, with_confidence=True)
+        if cache is not None:
+            print '  Melody cache: ', cache
     else:
-        mc_midi = np.loadtxt(mc_fp)
-    audio, sr = rosa.load(audio_fp, sr=None, mono=True)
+        mc_midi = load_contour(mc_fp)
+        confidence = None
+        if path.splitext(mc_fp)[1] == EXT and 'confidence' in read_header(mc_fp)['fields']:
+            confidence = load_contour(mc_fp, 'confidence')
     melody = Contour(0, mc_midi)
-    notes = transcribe(audio, melody, asc_model_fp, desc_model_fp, save_dir, audio_fn)
+    ### the frames guessed unvoiced are tracked too, unless voiced_only
+    if not voiced_only: confidence = None
+    notes = transcribe(audio, melody, asc_model_fp, desc_model_fp, save_dir, audio_fn, confidence)
     if eval_note is not None:
         sg = Song(name=audio_fn)
         sg.load_esn_list(eval_note)
@@ -151,13 +164,27 @@ Script for transcribing a song.
     p.add_argument('-o', '--output_dir', type=str, metavar='output_dir', default='outputs',
                     help='The output directory.')
     p.add_argument('-m', '--melody_contour', type=str, default=None, 
-                    help='The filepath of melody contour.')
+                    help='The filepath of melody contour (binary .mc file or text file).')
     p.add_argument('-e', '--evaluate', type=str, default=None, 
                     help='The filepath of answer file.')
+    p.add_argument('-b', '--backend', type=str, default='melodia', choices=BACKENDS,
+                    help='The pitch tracker of the melody extraction.')
+    p.add_argument('--coarse', type=int, default=None, metavar='FACTOR',
+                    help='Extract the melody coarse to fine, with a coarse hop of FACTOR hops '
+                         '(mostly a saving with yin, melodia needs 2s of context around every transition).')
+    p.add_argument('-c', '--cache_dir', type=str, default=None,
+                    help='The directory of the cache of extracted melody contours.')
+    p.add_argument('--cache_size', type=float, default=MAX_SIZE / 2.**20,
+                    help='The size limit of the melody cache in MB.')
+    p.add_argument('--voiced_only', action='store_true', default=False,
+                    help='Track only the frames of positive pitch confidence, without the frames '
+                         'MELODIA guesses unvoiced (changes the notes).')
     return p.parse_args()
 
 if __name__ == '__main__':
     args = parser()
     main(args.audio_fp, args.asc_model_fp, args.desc_model_fp, 
-         args.output_dir, args.melody_contour, args.evaluate)
+         args.output_dir, args.melody_contour, args.evaluate,
+         cache_dir=args.cache_dir, cache_size=args.cache_size * 2**20, backend=args.backend,
+         coarse=args.coarse, voiced_only=args.voiced_only)
 
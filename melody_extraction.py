@@ -15,19 +15,35 @@ Optional args:
     Please refer to --help.
 ----------------------------------------------------------------------
 Returns:
+    Melody contour:             Binary file (Melody.mc) of estimated melody 
+                                contour in Hz and in MIDI scale, see 
+                                guitar_trans/melody_io.py.
     Raw melody contour:         Text file of estimated melody contour 
-                                in Hz with extenion of .raw.melody.
+                                in Hz (RawMelody.txt, with --txt).
     MIDI-scale melody contour:  Text file of estimated melody contour 
-                                in MIDI with extenion of .MIDI.melody.
-    Smoothed melody contour:    Text file of moving-averged estimated 
-                                melody contour in MIDI scale with extenion 
-                                of .smooth.MIDI.melody.
+                                in MIDI (MidiMelody.txt, with --txt).
 
 """
-import glob, os, sys
+import glob, os, sys, time
 import numpy as np
-from essentia.standard import *
+from itertools import imap
+from multiprocessing import Pool
+try:
+    from essentia.standard import MonoLoader, PitchMelodia
+except ImportError:
+    ### the YIN backend and the librosa decoding do not need essentia
+    MonoLoader = PitchMelodia = None
 from guitar_trans.parameters import *
+from guitar_trans.melody_io import melodia_params, save_melody, EXT
+from guitar_trans.melody_cache import MelodyCache, MAX_SIZE
+from guitar_trans.audio import load_audio, read_audio
+from guitar_trans.yin import Yin
+
+BACKENDS = ['melodia', 'yin']
+### audio context of the dense regions of coarse_to_fine in seconds: MELODIA 
+### selects and voices contours over its whole input (as in extract_melody_stream),
+### YIN is frame-local
+DENSE_CONTEXT = {'melodia': 2., 'yin': 0.1}
 
 def hertz2midi(melody_contour):
     """
@@ -39,7 +55,9 @@ def hertz2midi(melody_contour):
     """ 
     from numpy import inf
     melody_contour_MIDI = melody_contour.copy()
-    melody_contour_MIDI = np.log(melody_contour_MIDI/float(440))
+    ### unvoiced frames of 0 Hz give -inf, set to 0 below
+    with np.errstate(divide='ignore'):
+        melody_contour_MIDI = np.log(melody_contour_MIDI/float(440))
     melody_contour_MIDI =12*melody_contour_MIDI/np.log(2)+69
     melody_contour_MIDI[melody_contour_MIDI==-inf]=0
 
@@ -71,27 +89,252 @@ def parse_input_files(input_files, ext='.wav'):
     for f in files: print '    ', f
     return files
 
-def extract_melody(audio_file, save_dir=None):
-    if not os.path.exists(save_dir): os.makedirs(save_dir)
-    ###  initiate MELODIA
-    pcm = PitchMelodia(harmonicWeight=harmonicWeight, minDuration=minDuration, 
-        binResolution=binResolution, guessUnvoiced=guessUnvoiced, frameSize=frameSize, 
-        hopSize=HOP_LENGTH, maxFrequency=maxFrequency, minFrequency=minFrequency, 
-        filterIterations=filterIterations, magnitudeThreshold=magnitudeThreshold, 
-        sampleRate=SAMPLING_RATE, peakDistributionThreshold=peakDistributionThreshold)
-    audio = MonoLoader(filename = audio_file, sampleRate=SAMPLING_RATE)()
-    ### run MELODIA
-    melody_contour, pitchConfidence = pcm(audio)
-    ### convert Hz to MIDI scale
-    melody_contour_MIDI = hertz2midi(melody_contour)
+def melodia():
+    """
+    Initiate MELODIA with the melody contour parameters.
+
+    :returns: essentia PitchMelodia algorithm.
+
+    """
+    if PitchMelodia is None:
+        raise ImportError('MELODIA needs essentia, use the yin backend without it.')
+    return PitchMelodia(**melodia_params())
+
+def pitch_tracker(backend='melodia', **params):
+    """
+    Initiate a pitch tracker: called on mono float32 audio at SAMPLING_RATE, 
+    it returns the pitch in Hz and its confidence for frames every HOP_LENGTH 
+    samples. Trackers other than MELODIA describe themselves by a params dict.
+
+    :param backend: one of BACKENDS.
+    :param params:  parameters replacing those of parameters.py (e.g. hopSize).
+    :returns:       pitch tracker.
+
+    """
+    if backend == 'melodia' and params:
+        if PitchMelodia is None:
+            raise ImportError('MELODIA needs essentia, use the yin backend without it.')
+        return PitchMelodia(**dict(melodia_params(), **params))
+    elif backend == 'melodia':
+        return melodia()
+    elif backend == 'yin':
+        return Yin(**params)
+    raise ValueError('Unknown pitch tracking backend {}.'.format(backend))
+
+def extract_melody(audio_file, save_dir=None, pcm=None, loader=None, txt=False, cache=None, audio=None,
+                   block=None, backend='melodia', coarse=None, with_confidence=False):
+    """
+    Extract the melody contour of an audio file with MELODIA or another pitch tracker.
+
+    :param audio_file: the path of the audio file.
+    :param save_dir:   directory for storing the results (not saved if None).
+    :param pcm:        pitch tracker to be reused (initiated if None).
+    :param loader:     MonoLoader to be reused (initiated if None, librosa 
+                       decodes the file without essentia).
+    :param txt:        also save the contours as text files.
+    :param cache:      MelodyCache of contours already extracted (not used if None).
+    :param audio:      mono float32 samples of the file at SAMPLING_RATE, already 
+                       decoded e.g. by guitar_trans.audio.load_audio (decoded if None).
+    :param block:      extract block by block with extract_melody_stream, with blocks 
+                       of this length in seconds (whole file at once if None). 
+                       The cache is not used in this mode.
+    :param backend:    pitch tracker initiated if pcm is None, one of BACKENDS.
+    :param coarse:     extract coarse to fine with coarse_to_fine, with a coarse hop 
+                       of this many HOP_LENGTH (whole file densely if None).
+    :param with_confidence: also return the pitch confidence.
+    :returns:          melody contour in Hz and in MIDI scale (and pitch confidence, 
+                       positive on voiced frames, None if a cached contour has none).
+
+    """
+    if save_dir is not None and not os.path.exists(save_dir): os.makedirs(save_dir)
+    ###  initiate the pitch tracker
+    if pcm is None:
+        pcm = pitch_tracker(backend)
+    params = getattr(pcm, 'params', None)
+    if coarse is not None and block is None:
+        params = dict(params or melodia_params(), coarse=coarse)
+    if block is not None:
+        ### run MELODIA block by block
+        chunks = list(extract_melody_stream(audio_file, block, pcm=pcm, audio=audio))
+        melody_contour = np.concatenate([c[0] for c in chunks])
+        melody_contour_MIDI = np.concatenate([c[1] for c in chunks])
+        pitchConfidence = np.concatenate([c[2] for c in chunks])
+    else:
+        if audio is None and MonoLoader is None:
+            audio, _ = load_audio(audio_file)
+        elif audio is None:
+            if loader is None:
+                loader = MonoLoader(filename=audio_file, sampleRate=SAMPLING_RATE)
+            else:
+                loader.configure(filename=audio_file, sampleRate=SAMPLING_RATE)
+            audio = loader()
+        ### look up the same audio analysed with the same parameters
+        key = cache.key(audio, params) if cache is not None else None
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            melody_contour, melody_contour_MIDI, pitchConfidence = cached
+        else:
+            if coarse is not None:
+                ### run the coarse pass and MELODIA near the transitions
+                melody_contour, pitchConfidence = coarse_to_fine(audio, coarse, pcm=pcm, backend=backend)
+            else:
+                ### run MELODIA
+                melody_contour, pitchConfidence = pcm(audio)
+            ### convert Hz to MIDI scale
+            melody_contour_MIDI = hertz2midi(melody_contour)
+            if cache is not None:
+                cache.put(key, melody_contour, melody_contour_MIDI, params, pitchConfidence)
     if save_dir is not None:
+        ### save result: raw and MIDI-scale melody contours and pitch confidence
+        fields = [('hz', melody_contour), ('midi', melody_contour_MIDI)]
+        if pitchConfidence is not None:
+            fields.append(('confidence', pitchConfidence))
+        save_melody(save_dir+os.sep+'Melody'+EXT, fields, params=params)
+    if save_dir is not None and txt:
         ### save result: raw melody contour
         np.savetxt(save_dir+os.sep+'RawMelody.txt', melody_contour, fmt='%s')
         ### save result: MIDI-scale melody contour
         np.savetxt(save_dir+os.sep+'MidiMelody.txt', melody_contour_MIDI, fmt='%s')
+    if with_confidence:
+        return melody_contour, melody_contour_MIDI, pitchConfidence
     return melody_contour, melody_contour_MIDI
 
-def main(audio_files, output_dir):
+def coarse_to_fine(audio, factor=4, threshold=0.5, margin=2, context=None, pcm=None, backend='melodia'):
+    """
+    Extract the melody contour coarse to fine: a pitch tracker with a hop of 
+    factor*HOP_LENGTH locates the pitch and voicing changes, and only the 
+    frames around them are tracked again every HOP_LENGTH samples, with 
+    some context. The other frames take the pitch of the nearest coarse 
+    frame, which is exact enough on steady notes. With YIN, sparse solos, 
+    mostly steady notes and rests, cost about 1/factor of a dense extraction. 
+    MELODIA needs seconds of context to match the dense contour, so dense 
+    regions closer than twice the context are merged and the saving is 
+    smaller, if any.
+
+    :param audio:     mono float32 samples at SAMPLING_RATE.
+    :param factor:    hop of the coarse pass in HOP_LENGTH.
+    :param threshold: pitch change between coarse frames in semitones 
+                      marking a transition.
+    :param margin:    coarse frames tracked densely on each side of a transition.
+    :param context:   audio analysed on each side of a dense region in seconds 
+                      (DENSE_CONTEXT of the backend if None).
+    :param pcm:       dense pitch tracker to be reused (initiated if None).
+    :param backend:   pitch trackers initiated, one of BACKENDS.
+    :returns:         melody contour in Hz and pitch confidence every HOP_LENGTH samples.
+
+    """
+    if pcm is None:
+        pcm = pitch_tracker(backend)
+    audio = np.ascontiguousarray(audio, dtype='float32')
+    n = 1 + len(audio) // HOP_LENGTH
+    mc_coarse, conf_coarse = pitch_tracker(backend, hopSize=HOP_LENGTH*factor)(audio)
+    ### coarse frames around pitch changes, voicing changes included
+    jump = np.abs(np.diff(hertz2midi(mc_coarse))) > threshold
+    marked = np.zeros(len(mc_coarse), dtype=bool)
+    marked[:-1] |= jump
+    marked[1:] |= jump
+    marked = np.convolve(marked, np.ones(2*margin+1), 'same') > 0
+    ### nearest coarse frame of every frame
+    idx = np.minimum((np.arange(n) + factor//2) // factor, len(mc_coarse)-1)
+    melody_contour = mc_coarse[idx].astype('float32')
+    pitchConfidence = conf_coarse[idx].astype('float32')
+    dense = marked[idx]
+    if dense.mean() > 0.5:
+        ### mostly transitions, a single dense pass is cheaper
+        return pcm(audio)
+    ### runs of dense frames, merged when their contexts overlap
+    if context is None: context = DENSE_CONTEXT[backend]
+    C = int(round(context * SAMPLING_RATE / HOP_LENGTH))
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], dense.view(np.int8), [0]))))
+    runs = []
+    for s, e in zip(edges[::2], edges[1::2]):
+        if runs and s - runs[-1][1] <= 2*C:
+            runs[-1][1] = e
+        else:
+            runs.append([s, e])
+    if sum(min(n, e + C) - max(0, s - C) for s, e in runs) > n:
+        ### contexts included, more than a dense pass
+        return pcm(audio)
+    for s, e in runs:
+        a, b = max(0, s - C), min(n, e + C)
+        mc, conf = pcm(audio[a*HOP_LENGTH:b*HOP_LENGTH])
+        melody_contour[s:e] = mc[s-a:e-a]
+        pitchConfidence[s:e] = conf[s-a:e-a]
+    return melody_contour, pitchConfidence
+
+def extract_melody_stream(audio_file, block=30., context=2., pcm=None, audio=None, backend='melodia'):
+    """
+    Extract the melody contour of an audio file block by block with MELODIA.
+
+    Every block is analysed together with some context on both sides and 
+    only its own frames are kept, so that memory is bounded by the block 
+    length instead of the file length. Blocks start on the HOP_LENGTH grid, 
+    hence the chunks are consecutive frames of the contour of the whole file.
+    MELODIA selects and voices pitch contours over the whole signal it is 
+    given, so the context should be a few times minDuration for the chunks 
+    to match the contour of the whole file away from the edges.
+
+    :param audio_file: the path of the audio file.
+    :param block:      length of the blocks in seconds.
+    :param context:    length of the context on each side of a block in seconds.
+    :param pcm:        pitch tracker to be reused (initiated if None).
+    :param audio:      mono float32 samples of the file at SAMPLING_RATE, 
+                       already decoded (decoded block by block if None).
+    :param backend:    pitch tracker initiated if pcm is None, one of BACKENDS.
+    :returns:          generator of chunks of the melody contour in Hz and 
+                       in MIDI scale and of the pitch confidence.
+
+    """
+    if pcm is None:
+        pcm = pitch_tracker(backend)
+    if audio is None:
+        read = lambda start, stop: read_audio(audio_file, start, stop)
+    else:
+        read = lambda start, stop: audio[start:stop]
+    ### block and context in frames
+    B = max(1, int(round(block * SAMPLING_RATE / HOP_LENGTH)))
+    C = int(round(context * SAMPLING_RATE / HOP_LENGTH))
+    b = 0
+    while True:
+        start, stop = max(0, b - C), b + B + C
+        ### one sample more tells whether the file ends with this block
+        x = read(start * HOP_LENGTH, stop * HOP_LENGTH + 1)
+        last = len(x) <= (stop - start) * HOP_LENGTH
+        if len(x) == 0:
+            break
+        x = np.ascontiguousarray(x[:(stop - start) * HOP_LENGTH], dtype='float32')
+        melody_contour, pitchConfidence = pcm(x)
+        ### frames of this block (all the remaining ones in the last block)
+        own = slice(b-start, None if last else b-start+B)
+        melody_contour, pitchConfidence = melody_contour[own], pitchConfidence[own]
+        yield melody_contour, hertz2midi(melody_contour), pitchConfidence
+        if last:
+            break
+        b += B
+
+### pitch tracker and loader of the current (worker) process, reused for all its files
+_algorithms = {}
+
+def _extract_file(job):
+    f, output_dir, txt, cache_dir, cache_size, block, backend, coarse = job
+    start = time.time()
+    if not _algorithms:
+        _algorithms['pcm'] = pitch_tracker(backend)
+        if MonoLoader is not None:
+            _algorithms['loader'] = MonoLoader(filename=f, sampleRate=SAMPLING_RATE)
+        if cache_dir is not None:
+            _algorithms['cache'] = MelodyCache(cache_dir, cache_size)
+    name = os.path.basename(f).split('.')[0]
+    save_dir = os.path.join(output_dir, name)
+    cache = _algorithms.get('cache')
+    hits = cache.hits if cache is not None else 0
+    melody_contour, _ = extract_melody(f, save_dir, txt=txt, block=block, backend=backend, coarse=coarse,
+                                       **_algorithms)
+    hit = cache is not None and cache.hits > hits
+    return f, len(melody_contour), time.time() - start, hit
+
+def main(audio_files, output_dir, workers=1, txt=False, cache_dir=None, cache_size=MAX_SIZE, block=None,
+         backend='melodia', coarse=None):
     print '============================'
     print 'Running melody extraction...'
     print '============================'
@@ -102,11 +345,30 @@ def main(audio_files, output_dir):
     if not os.path.exists(output_dir): os.makedirs(output_dir)
     print '  Output directory: ', '\n', '    ', output_dir
     
-    ### processing
-    for f in files:
-        name = os.path.basename(audio_file).split('.')[0]
-        save_dir = os.path.join(output_dir, name)
-        extract_melody(f, save_dir)
+    ### processing (files in parallel processes, each one with its own pitch tracker)
+    start = time.time()
+    jobs = [(f, output_dir, txt, cache_dir, cache_size, block, backend, coarse) for f in files]
+    if workers > 1:
+        pool = Pool(workers)
+        results = pool.imap_unordered(_extract_file, jobs)
+    else:
+        results = imap(_extract_file, jobs)
+    n_frames, n_hits = 0, 0
+    for i, (f, n, elapsed, hit) in enumerate(results):
+        n_frames += n
+        n_hits += hit
+        print '  [{}/{}] {} ({:.2f}s{})'.format(i+1, len(files), f, elapsed, ', cached' if hit else '')
+    if workers > 1:
+        pool.close()
+        pool.join()
+
+    ### summary
+    elapsed = time.time() - start
+    duration = n_frames * HOP_LENGTH / float(SAMPLING_RATE)
+    print '  {} files, {:.1f}s of audio in {:.1f}s ({:.1f}x real time)'.format(
+        len(files), duration, elapsed, duration / max(elapsed, 1e-9))
+    if cache_dir is not None:
+        print '  Melody cache: {} hits, {} misses'.format(n_hits, len(files) - n_hits)
         
 
 def parser():
@@ -130,6 +392,23 @@ Script for extracting melody contour
                    help='files to be processed')
     p.add_argument('output_dir', type=str, metavar='output_dir',
                    help='output directory.')
+    p.add_argument('-j', '--workers', type=int, default=1,
+                   help='number of files processed in parallel processes')
+    p.add_argument('-b', '--backend', type=str, default='melodia', choices=BACKENDS,
+                   help='pitch tracker (yin: NumPy YIN for monophonic tracks, without essentia)')
+    p.add_argument('--coarse', type=int, default=None, metavar='FACTOR',
+                   help='extract coarse to fine, with a coarse hop of FACTOR hops '
+                        'and dense tracking only near pitch transitions (mostly a saving '
+                        'with yin, melodia needs 2s of context around every transition)')
+    p.add_argument('--txt', action='store_true', default=False,
+                   help='also save the melody contours as text files')
+    p.add_argument('--cache_dir', type=str, default=None,
+                   help='directory of the cache of extracted melody contours')
+    p.add_argument('--cache_size', type=float, default=MAX_SIZE / 2.**20,
+                   help='size limit of the melody cache in MB')
+    p.add_argument('--block', type=float, default=None, metavar='SECONDS',
+                   help='extract block by block with blocks of this length '
+                        '(bounded memory for long files, the cache is not used)')
     ### version
     p.add_argument('--version', action='version',
                    version='%(prog)spec 2.01 (2017-06-30)')
@@ -138,4 +417,5 @@ Script for extracting melody contour
     
 if __name__ == '__main__':
     args = parser()
-    main(args.audio_files, args.output_dir)
\ No newline at end of file
+    main(args.input_files, args.output_dir, args.workers, args.txt,
+         args.cache_dir, args.cache_size * 2**20, args.block, args.backend, args.coarse)
\ No newline at end of file